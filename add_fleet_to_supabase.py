@@ -48,28 +48,36 @@ def add_fleet_vehicles():
     print()
     
     client = get_supabase_client()
+    
+    # Single bulk upsert; rows whose VIN already exists (including ones
+    # inserted concurrently) are skipped instead of failing the batch
+    added_vins = set()
+    existing_vins = set()
+    upserted = False
+    try:
+        response = client.client.table('vehicles') \
+            .upsert(vehicles, on_conflict='vin', ignore_duplicates=True) \
+            .execute()
+        # Only newly inserted rows come back
+        added_vins = {v['vin'] for v in response.data or []}
+        upserted = True
+    except Exception as e:
+        print(f"✗ Error adding vehicles: {e}")
+        # One query to tell which fleet vehicles were already there
+        existing_vins = client.get_vehicles_by_vins([v["vin"] for v in vehicles])
+    
     added = 0
     existing = 0
-    
     for vehicle in vehicles:
-        try:
-            # Check if vehicle already exists
-            result = client.get_vehicle_by_vin(vehicle["vin"])
-            if result:
-                print(f"✓ Vehicle {vehicle['vin'][-6:]} already exists: {vehicle['model']}")
-                existing += 1
-                continue
-            
-            # Insert new vehicle
-            response = client.client.table('vehicles').insert(vehicle).execute()
-            if response.data:
-                print(f"✓ Added vehicle {vehicle['vin'][-6:]}: {vehicle['model']}")
-                added += 1
-            else:
-                print(f"✗ Failed to add {vehicle['vin'][-6:]}")
-        
-        except Exception as e:
-            print(f"✗ Error adding {vehicle['vin'][-6:]}: {e}")
+        if vehicle["vin"] in added_vins:
+            print(f"✓ Added vehicle {vehicle['vin'][-6:]}: {vehicle['model']}")
+            added += 1
+        elif upserted or vehicle["vin"] in existing_vins:
+            # The upsert succeeded, so a VIN it didn't insert was already there
+            print(f"✓ Vehicle {vehicle['vin'][-6:]} already exists: {vehicle['model']}")
+            existing += 1
+        else:
+            print(f"✗ Failed to add {vehicle['vin'][-6:]}")
     
     print()
     print(f"Summary: {added} added, {existing} already existed")
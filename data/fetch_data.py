@@ -1,5 +1,9 @@
 import teslapy
-import json
+import orjson
+import os
+import queue
+import random
+import threading
 import time
 from datetime import datetime
 import config
@@ -9,7 +13,70 @@ from requests.exceptions import HTTPError
 EMAIL = config.EMAIL
 LOG_FILE = 'tesla_raw_log.jsonl' # JSON Lines format (one JSON object per line)
 MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
+RETRY_DELAY = 5  # seconds (base for exponential backoff)
+MAX_RETRY_DELAY = 60  # seconds
+
+# Background writer: rows are written in batches of up to WRITE_BATCH_SIZE
+# (or whatever arrived within WRITE_BATCH_TIMEOUT), fsync'd every FSYNC_INTERVAL
+WRITE_BATCH_SIZE = 30        # one minute at the 2s driving poll rate
+WRITE_BATCH_TIMEOUT = 5.0    # seconds
+FSYNC_INTERVAL = 10.0        # seconds
+WRITE_QUEUE_SIZE = 1000      # rows waiting for the writer; newest dropped beyond this
+_STOP = object()             # sentinel telling the writer to finish
+
+_encode = orjson.dumps
+
+# Adaptive polling: only poll fast while the car is driving or charging
+ACTIVE_POLL_INTERVAL = 2     # seconds
+PARKED_POLL_INTERVAL = 60    # seconds
+ASLEEP_POLL_INTERVAL = 300   # seconds
+
+def poll_interval(vehicle_data):
+    """Pick the next poll interval from the vehicle's drive/charge state"""
+    drive = vehicle_data.get('drive_state') or {}
+    charge = vehicle_data.get('charge_state') or {}
+    if drive.get('shift_state') in ('D', 'R', 'N') or charge.get('charging_state') == 'Charging':
+        return ACTIVE_POLL_INTERVAL
+    return PARKED_POLL_INTERVAL
+
+def writer_loop(rows, log_file):
+    """Append queued rows to the log in batches, off the polling thread"""
+    with open(log_file, 'ab') as f: # Append mode
+        last_fsync = time.monotonic()
+        running = True
+        while running:
+            # Wait for a row, then gather more until the batch is full or stale
+            items = [rows.get()]
+            deadline = time.monotonic() + WRITE_BATCH_TIMEOUT
+            while len(items) < WRITE_BATCH_SIZE and items[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(rows.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            batch = items
+            if items[-1] is _STOP:
+                running = False
+                batch = items[:-1]
+            
+            try:
+                if batch:
+                    f.write(b"".join(_encode(row) + b"\n" for row in batch))
+                    f.flush()
+                
+                now = time.monotonic()
+                if not running or now - last_fsync >= FSYNC_INTERVAL:
+                    os.fsync(f.fileno())
+                    last_fsync = now
+            except (OSError, TypeError) as e:
+                # Disk full, EIO, unserializable row... keep the writer alive
+                print(f"Error writing {len(batch)} rows to {log_file}: {e}")
+            finally:
+                for _ in items:
+                    rows.task_done()
 
 def main():
     print("Authenticating...")
@@ -20,51 +87,85 @@ def main():
         
         vehicle = tesla.vehicle_list()[0]
         print(f"Connected to: {vehicle['display_name']}")
-        
-        if vehicle['state'] != 'online':
-            print("Waking up...")
-            vehicle.sync_wake_up()
 
         print(f"Logging RAW data to {LOG_FILE}... Press Ctrl+C to stop.")
         
-        with open(LOG_FILE, 'a') as f: # Append mode
-            try:
-                while True:
-                    # Retry logic for fetching data
-                    for attempt in range(MAX_RETRIES):
+        # Disk writes happen on a separate thread so an IO stall can't
+        # delay the next API poll
+        rows = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        writer = threading.Thread(target=writer_loop, args=(rows, LOG_FILE), daemon=True)
+        writer.start()
+        
+        # The (cheap) state check only runs at startup, while parked, and
+        # after a failed fetch; active polling goes straight to vehicle_data
+        check_state = True
+        
+        try:
+            while True:
+                # Don't wake a sleeping car just to log it; check back later
+                if check_state:
+                    try:
+                        vehicle.get_vehicle_summary()
+                    except Exception as e:
+                        print(f"Error fetching vehicle state: {e}")
+                        time.sleep(RETRY_DELAY)
+                        continue
+                    if vehicle['state'] != 'online':
+                        print(f"Vehicle is {vehicle['state']}, checking again in {ASLEEP_POLL_INTERVAL}s")
+                        time.sleep(ASLEEP_POLL_INTERVAL)
+                        continue
+                
+                interval = ACTIVE_POLL_INTERVAL
+                fetched = False
+                
+                # Retry logic for fetching data
+                for attempt in range(MAX_RETRIES):
+                    try:
+                        # 1. Fetch EVERYTHING
+                        vehicle_data = vehicle.get_vehicle_data()
+                        
+                        # 2. Add a local timestamp (for your own debugging)
+                        vehicle_data['local_timestamp'] = datetime.now().isoformat(timespec='milliseconds')
+                        
+                        # 3. Hand the full JSON object to the writer thread
                         try:
-                            # 1. Fetch EVERYTHING
-                            vehicle_data = vehicle.get_vehicle_data()
-                            
-                            # 2. Add a local timestamp (for your own debugging)
-                            vehicle_data['local_timestamp'] = datetime.now().isoformat()
-                            
-                            # 3. Write the full JSON object as one line
-                            f.write(json.dumps(vehicle_data) + "\n")
-                            f.flush()
-                            
-                            # Console feedback (just so you know it's working)
-                            speed = vehicle_data['drive_state'].get('speed', 0)
-                            print(f"Logged raw packet. Speed: {speed}")
-                            break  # Success, exit retry loop
-                            
-                        except HTTPError as e:
-                            if '408' in str(e) or 'timeout' in str(e).lower():
-                                print(f"Timeout (attempt {attempt + 1}/{MAX_RETRIES}). Retrying...")
-                                if attempt < MAX_RETRIES - 1:
-                                    time.sleep(RETRY_DELAY)
-                                else:
-                                    print("Max retries reached. Skipping this data point.")
+                            rows.put_nowait(vehicle_data)
+                        except queue.Full:
+                            print("Writer is behind, dropping this data point.")
+                        
+                        # Console feedback (just so you know it's working)
+                        speed = vehicle_data['drive_state'].get('speed', 0)
+                        print(f"Logged raw packet. Speed: {speed}")
+                        interval = poll_interval(vehicle_data)
+                        fetched = True
+                        break  # Success, exit retry loop
+                        
+                    except HTTPError as e:
+                        if '408' in str(e) or '429' in str(e) or 'timeout' in str(e).lower():
+                            print(f"Timeout/rate limited (attempt {attempt + 1}/{MAX_RETRIES}). Retrying...")
+                            if attempt < MAX_RETRIES - 1:
+                                # Exponential backoff with jitter
+                                time.sleep(min(RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY) + random.random())
                             else:
-                                raise  # Re-raise non-timeout errors
-                        except Exception as e:
-                            print(f"Error fetching data: {e}")
-                            break  # Skip this iteration
-                    
-                    time.sleep(2) # 2s poll rate
-                    
-            except KeyboardInterrupt:
-                print("\nStopped. Raw data saved.")
+                                print("Max retries reached. Skipping this data point.")
+                        else:
+                            raise  # Re-raise non-timeout errors
+                    except Exception as e:
+                        print(f"Error fetching data: {e}")
+                        break  # Skip this iteration
+                
+                # Re-check state after a failure (e.g. 408: car fell asleep)
+                # or while parked; skip it during active polling
+                check_state = not fetched or interval != ACTIVE_POLL_INTERVAL
+                time.sleep(interval)
+                
+        except KeyboardInterrupt:
+            print("\nStopped. Raw data saved.")
+        finally:
+            # Let the writer drain the queue and fsync before exiting
+            if writer.is_alive():
+                rows.put(_STOP)
+                writer.join()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
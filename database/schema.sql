@@ -80,6 +80,28 @@ CREATE TRIGGER update_vehicles_updated_at
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+-- Aggregate telemetry stats in the database (called via RPC from
+-- SupabaseClient.get_analytics_summary). Zero readings are ignored,
+-- matching the Python fallback.
+CREATE OR REPLACE FUNCTION analytics_summary(p_vehicle_id UUID, p_days INTEGER DEFAULT 7)
+RETURNS TABLE (
+    total_records BIGINT,
+    avg_speed DOUBLE PRECISION,
+    avg_battery DOUBLE PRECISION,
+    max_speed REAL,
+    min_battery INTEGER
+) AS $$
+    SELECT
+        COUNT(*),
+        COALESCE(AVG(NULLIF(vehicle_speed, 0)), 0),
+        COALESCE(AVG(NULLIF(battery_level, 0)), 0),
+        COALESCE(MAX(NULLIF(vehicle_speed, 0)), 0),
+        COALESCE(MIN(NULLIF(battery_level, 0)), 0)
+    FROM telemetry_data
+    WHERE vehicle_id = p_vehicle_id
+      AND received_at >= NOW() - make_interval(days => p_days);
+$$ LANGUAGE sql STABLE;
+
 -- Sample vehicle for testing
 INSERT INTO vehicles (vin, model, year, owner_email)
 VALUES ('5YJ3E1EA1KF000001', 'Model 3 Long Range', 2023, 'demo@tesla-telemetry.com')
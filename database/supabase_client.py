@@ -4,8 +4,16 @@ Handles database operations for telemetry data
 """
 
 import os
-from typing import Optional, List, Dict
-from supabase import create_client, Client
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Optional, List, Dict, Deque, Set, TypedDict
+import httpx
+from supabase import create_client, Client, ClientOptions
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
 from dotenv import load_dotenv
 import logging
 
@@ -14,6 +22,41 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Telemetry write batching: flush after this many pending rows or this many
+# seconds since the last flush, whichever comes first
+TELEMETRY_BATCH_SIZE = int(os.getenv("TELEMETRY_BATCH_SIZE", "500"))
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "2.0"))
+
+# Shared HTTP connection pool settings
+HTTP_TIMEOUT = 30  # seconds
+HTTP_MAX_KEEPALIVE = 32
+HTTP_MAX_CONNECTIONS = 64
+
+# Maximum concurrent async batch inserts (gains flatten out beyond 2-4)
+UPLOAD_CONCURRENCY = int(os.getenv("SUPABASE_UPLOAD_CONCURRENCY", "4"))
+
+# Failed batch inserts: transient errors are retried with backoff; a batch
+# the database rejects is split in half until only the bad rows are dropped
+INSERT_RETRIES = 2
+INSERT_RETRY_DELAY = 0.5  # seconds, doubled per retry
+
+
+def _is_row_error(error: Exception) -> bool:
+    """True if PostgREST rejected the rows themselves (SQLSTATE class 22/23)"""
+    return isinstance(error, APIError) and str(error.code or "")[:2] in ("22", "23")
+
+
+class TelemetryRow(TypedDict):
+    """A telemetry_data row, typed to match the table schema"""
+    vehicle_id: str
+    timestamp: Optional[int]
+    vehicle_speed: Optional[float]
+    battery_level: int
+    power_kw: Optional[float]
+    odometer: Optional[float]
+    heading: int
+    is_compressed: bool
+
 
 class SupabaseClient:
     """Wrapper for Supabase operations"""
@@ -25,7 +68,32 @@ class SupabaseClient:
         if not self.url or not self.key:
             raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set")
         
-        self.client: Client = create_client(self.url, self.key)
+        # One pooled HTTP/2 client shared by all requests, so keep-alive
+        # connections are reused instead of paying a TCP+TLS handshake per call
+        self.http_client = httpx.Client(
+            http2=True,
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                max_connections=HTTP_MAX_CONNECTIONS
+            )
+        )
+        options = ClientOptions(httpx_client=self.http_client)
+        self.client: Client = create_client(self.url, self.key, options=options)
+        
+        # Pending telemetry rows per vehicle_id, written out by flush()
+        self._pending: Dict[str, Deque[Dict]] = {}
+        self._pending_count = 0
+        self._last_flush = time.monotonic()
+        self._pending_lock = threading.Lock()
+        
+        # Async client for the ingest path, created by start_async() (or on
+        # first use) inside the event loop that owns it; closed by aclose()
+        self._async_client: Optional[AsyncClient] = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        self._async_client_lock: Optional[asyncio.Lock] = None
+        self._upload_semaphore: Optional[asyncio.Semaphore] = None
+        
         logger.info("Supabase client initialized")
     
     def get_vehicle_by_vin(self, vin: str) -> Optional[Dict]:
@@ -34,29 +102,232 @@ class SupabaseClient:
             response = self.client.table('vehicles').select("*").eq('vin', vin).single().execute()
             return response.data
         except Exception as e:
-            logger.error(f"Error fetching vehicle {vin}: {e}")
+            logger.error("Error fetching vehicle %s: %s", vin, e)
             return None
     
+    def get_vehicles_by_vins(self, vins: List[str]) -> Set[str]:
+        """Return the subset of VINs that exist, using a single query"""
+        if not vins:
+            return set()
+        try:
+            response = self.client.table('vehicles').select('vin').in_('vin', vins).execute()
+            return {v['vin'] for v in response.data or []}
+        except Exception as e:
+            logger.error("Error fetching vehicles by VIN: %s", e)
+            return set()
+    
+    @staticmethod
+    def _telemetry_row(vehicle_id: str, telemetry_data: Dict) -> TelemetryRow:
+        """Map a telemetry dict to a telemetry_data table row"""
+        return {
+            "vehicle_id": vehicle_id,
+            "timestamp": telemetry_data.get("timestamp"),
+            "vehicle_speed": telemetry_data.get("speed"),
+            "battery_level": int(telemetry_data.get("battery", 0)),  # Convert to int
+            "power_kw": telemetry_data.get("power"),
+            "odometer": telemetry_data.get("odometer"),
+            "heading": int(telemetry_data.get("heading", 0)),  # Convert to int
+            "is_compressed": telemetry_data.get("is_compressed", False)
+        }
+    
+    @staticmethod
+    def _telemetry_rows(vehicle_id: str, records: List[Dict]) -> List[TelemetryRow]:
+        """Map a batch of telemetry dicts to rows, skipping records that can't be"""
+        rows = []
+        for t in records:
+            try:
+                # battery_level/heading are INTEGER columns but arrive as floats;
+                # int() rejects a missing (None) or NaN value instead of storing 0
+                battery = int(t.get("battery", 0))
+                heading = int(t.get("heading", 0))
+            except (TypeError, ValueError, OverflowError) as e:
+                logger.warning("Skipping telemetry row for vehicle %s: %s", vehicle_id, e)
+                continue
+            rows.append({
+                "vehicle_id": vehicle_id,
+                "timestamp": t.get("timestamp"),
+                "vehicle_speed": t.get("speed"),
+                "battery_level": battery,
+                "power_kw": t.get("power"),
+                "odometer": t.get("odometer"),
+                "heading": heading,
+                "is_compressed": t.get("is_compressed", False)
+            })
+        return rows
+    
     def insert_telemetry(self, vehicle_id: str, telemetry_data: Dict) -> bool:
         """Insert telemetry data"""
         try:
-            data = {
-                "vehicle_id": vehicle_id,
-                "timestamp": telemetry_data.get("timestamp"),
-                "vehicle_speed": telemetry_data.get("speed"),
-                "battery_level": int(telemetry_data.get("battery", 0)),  # Convert to int
-                "power_kw": telemetry_data.get("power"),
-                "odometer": telemetry_data.get("odometer"),
-                "heading": int(telemetry_data.get("heading", 0)),  # Convert to int
-                "is_compressed": telemetry_data.get("is_compressed", False)
-            }
+            data = self._telemetry_row(vehicle_id, telemetry_data)
             
             self.client.table('telemetry_data').insert(data).execute()
-            logger.debug(f"Inserted telemetry for vehicle {vehicle_id}")
+            logger.debug("Inserted telemetry for vehicle %s", vehicle_id)
+            return True
+        except Exception as e:
+            logger.error("Error inserting telemetry: %s", e)
+            return False
+    
+    def insert_telemetry_batch(self, vehicle_id: str, rows: List[Dict]) -> bool:
+        """Insert many telemetry records for one vehicle in a single request"""
+        if not rows:
+            return True
+        try:
+            data = self._telemetry_rows(vehicle_id, rows)
+        except Exception as e:
+            logger.error("Error inserting telemetry batch: %s", e)
+            return False
+        if not data:
+            return False
+        return self._insert_rows(vehicle_id, data)
+    
+    def _insert_rows(self, vehicle_id: str, data: List[TelemetryRow]) -> bool:
+        """Insert rows, retrying transient errors and splitting rejected batches"""
+        for attempt in range(INSERT_RETRIES + 1):
+            try:
+                # returning=minimal so PostgREST doesn't echo the inserted rows back
+                self.client.table('telemetry_data') \
+                    .insert(data, returning=ReturnMethod.minimal) \
+                    .execute()
+                logger.debug("Inserted %d telemetry rows for vehicle %s", len(data), vehicle_id)
+                return True
+            except Exception as e:
+                error = e
+            if _is_row_error(error) or attempt == INSERT_RETRIES:
+                break
+            time.sleep(INSERT_RETRY_DELAY * 2 ** attempt)
+        
+        if not _is_row_error(error) or len(data) == 1:
+            logger.error("Dropping %d telemetry rows for vehicle %s: %s", len(data), vehicle_id, error)
+            return False
+        mid = len(data) // 2
+        first = self._insert_rows(vehicle_id, data[:mid])
+        return self._insert_rows(vehicle_id, data[mid:]) and first
+    
+    def queue_telemetry(self, vehicle_id: str, telemetry_data: Dict) -> bool:
+        """
+        Buffer a telemetry record for batched insertion.
+        Returns True once a flush is due: TELEMETRY_BATCH_SIZE rows are queued
+        or TELEMETRY_FLUSH_INTERVAL seconds have passed since the last flush.
+        The caller then writes the rows with flush() or flush_async().
+        This only runs on append, so callers should also poll flush_due()
+        on a timer to write out rows left behind when traffic stops.
+        """
+        with self._pending_lock:
+            pending = self._pending.get(vehicle_id)
+            if pending is None:
+                pending = self._pending[vehicle_id] = deque()
+            pending.append(telemetry_data)
+            self._pending_count += 1
+            
+            return (self._pending_count >= TELEMETRY_BATCH_SIZE or
+                    time.monotonic() - self._last_flush >= TELEMETRY_FLUSH_INTERVAL)
+    
+    def flush_due(self) -> bool:
+        """True if rows are buffered and TELEMETRY_FLUSH_INTERVAL has passed since the last flush"""
+        with self._pending_lock:
+            return (self._pending_count > 0 and
+                    time.monotonic() - self._last_flush >= TELEMETRY_FLUSH_INTERVAL)
+    
+    def take_pending(self) -> Dict[str, List[Dict]]:
+        """Remove and return all buffered rows, keyed by vehicle_id"""
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = {}
+            self._pending_count = 0
+            self._last_flush = time.monotonic()
+        return {vehicle_id: list(rows) for vehicle_id, rows in pending.items()}
+    
+    def flush(self) -> bool:
+        """Write all pending telemetry rows, one request per vehicle"""
+        ok = True
+        for vehicle_id, rows in self.take_pending().items():
+            ok = self.insert_telemetry_batch(vehicle_id, rows) and ok
+        return ok
+    
+    async def start_async(self) -> None:
+        """Create the async client; call once from the event loop at startup"""
+        await self._get_async_client()
+    
+    async def _get_async_client(self) -> AsyncClient:
+        """Create the async client and upload semaphore on first use"""
+        if self._async_client is not None:
+            return self._async_client
+        if self._async_client_lock is None:
+            self._async_client_lock = asyncio.Lock()
+        # Concurrent first uploads must not each build a client and semaphore
+        async with self._async_client_lock:
+            if self._async_client is None:
+                http_client = httpx.AsyncClient(
+                    http2=True,
+                    timeout=HTTP_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                        max_connections=HTTP_MAX_CONNECTIONS
+                    )
+                )
+                options = AsyncClientOptions(httpx_client=http_client)
+                self._upload_semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+                self._async_http_client = http_client
+                self._async_client = await acreate_client(self.url, self.key, options=options)
+        return self._async_client
+    
+    async def aclose(self) -> None:
+        """Close the async client's connection pool"""
+        http_client = self._async_http_client
+        self._async_client = None
+        self._async_http_client = None
+        if http_client is not None:
+            await http_client.aclose()
+    
+    def close(self) -> None:
+        """Close the sync client's connection pool"""
+        self.http_client.close()
+    
+    async def insert_telemetry_batch_async(self, vehicle_id: str, rows: List[Dict]) -> bool:
+        """Async insert_telemetry_batch; at most UPLOAD_CONCURRENCY run at once"""
+        if not rows:
             return True
+        try:
+            client = await self._get_async_client()
+            data = self._telemetry_rows(vehicle_id, rows)
         except Exception as e:
-            logger.error(f"Error inserting telemetry: {e}")
+            logger.error("Error inserting telemetry batch: %s", e)
             return False
+        if not data:
+            return False
+        return await self._insert_rows_async(client, vehicle_id, data)
+    
+    async def _insert_rows_async(self, client: AsyncClient, vehicle_id: str,
+                                 data: List[TelemetryRow]) -> bool:
+        """Async _insert_rows; each request waits for an upload slot"""
+        for attempt in range(INSERT_RETRIES + 1):
+            try:
+                async with self._upload_semaphore:
+                    await client.table('telemetry_data') \
+                        .insert(data, returning=ReturnMethod.minimal) \
+                        .execute()
+                logger.debug("Inserted %d telemetry rows for vehicle %s", len(data), vehicle_id)
+                return True
+            except Exception as e:
+                error = e
+            if _is_row_error(error) or attempt == INSERT_RETRIES:
+                break
+            await asyncio.sleep(INSERT_RETRY_DELAY * 2 ** attempt)
+        
+        if not _is_row_error(error) or len(data) == 1:
+            logger.error("Dropping %d telemetry rows for vehicle %s: %s", len(data), vehicle_id, error)
+            return False
+        mid = len(data) // 2
+        first = await self._insert_rows_async(client, vehicle_id, data[:mid])
+        return await self._insert_rows_async(client, vehicle_id, data[mid:]) and first
+    
+    async def flush_async(self) -> bool:
+        """Write all pending telemetry rows concurrently"""
+        results = await asyncio.gather(*(
+            self.insert_telemetry_batch_async(vehicle_id, rows)
+            for vehicle_id, rows in self.take_pending().items()
+        ))
+        return all(results)
     
     def get_recent_telemetry(self, vehicle_id: str, limit: int = 100) -> List[Dict]:
         """Get recent telemetry for a vehicle"""
@@ -69,7 +340,7 @@ class SupabaseClient:
                 .execute()
             return response.data
         except Exception as e:
-            logger.error(f"Error fetching telemetry: {e}")
+            logger.error("Error fetching telemetry: %s", e)
             return []
     
     def get_telemetry_by_time_range(
@@ -89,7 +360,7 @@ class SupabaseClient:
                 .execute()
             return response.data
         except Exception as e:
-            logger.error(f"Error fetching telemetry by time range: {e}")
+            logger.error("Error fetching telemetry by time range: %s", e)
             return []
     
     def update_compression_stats(
@@ -115,10 +386,10 @@ class SupabaseClient:
                 .upsert(data, on_conflict='vehicle_id,date') \
                 .execute()
             
-            logger.debug(f"Updated compression stats for vehicle {vehicle_id}")
+            logger.debug("Updated compression stats for vehicle %s", vehicle_id)
             return True
         except Exception as e:
-            logger.error(f"Error updating compression stats: {e}")
+            logger.error("Error updating compression stats: %s", e)
             return False
     
     def create_offline_session(self, vehicle_id: str, started_at: str) -> Optional[int]:
@@ -131,10 +402,10 @@ class SupabaseClient:
             }).execute()
             
             session_id = response.data[0]['id']
-            logger.info(f"Created offline session {session_id} for vehicle {vehicle_id}")
+            logger.info("Created offline session %s for vehicle %s", session_id, vehicle_id)
             return session_id
         except Exception as e:
-            logger.error(f"Error creating offline session: {e}")
+            logger.error("Error creating offline session: %s", e)
             return None
     
     def complete_offline_session(
@@ -156,17 +427,30 @@ class SupabaseClient:
                 .eq('id', session_id) \
                 .execute()
             
-            logger.info(f"Completed offline session {session_id}")
+            logger.info("Completed offline session %s", session_id)
             return True
         except Exception as e:
-            logger.error(f"Error completing offline session: {e}")
+            logger.error("Error completing offline session: %s", e)
             return False
     
     def get_analytics_summary(self, vehicle_id: str, days: int = 7) -> Dict:
         """Get analytics summary for a vehicle"""
         try:
-            # This would use a custom SQL query or Supabase RPC function
-            # For now, return basic stats
+            # Aggregate in Postgres so only one row crosses the wire
+            response = self.client.rpc('analytics_summary', {
+                "p_vehicle_id": vehicle_id,
+                "p_days": days
+            }).execute()
+            
+            rows = response.data or []
+            if not rows or not rows[0].get("total_records"):
+                return {}
+            return rows[0]
+        except Exception as e:
+            # analytics_summary() not installed (e.g. local dev database)
+            logger.warning("analytics_summary RPC unavailable, aggregating locally: %s", e)
+        
+        try:
             telemetry = self.get_recent_telemetry(vehicle_id, limit=1000)
             
             if not telemetry:
@@ -183,7 +467,7 @@ class SupabaseClient:
                 "min_battery": min(batteries) if batteries else 0
             }
         except Exception as e:
-            logger.error(f"Error getting analytics: {e}")
+            logger.error("Error getting analytics: %s", e)
             return {}
 
 
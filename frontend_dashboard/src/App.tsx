@@ -35,14 +35,30 @@ interface CompressionStats {
 }
 
 interface WebSocketMessage {
-  type: 'history' | 'telemetry' | 'log';
+  type: 'history' | 'telemetry' | 'batch' | 'log';
   data?: TelemetryData | TelemetryData[];
+  items?: WebSocketMessage[];  // batch: telemetry/log messages in arrival order
   message?: string;
   log_type?: 'info' | 'success' | 'error' | 'warning';
   compression_stats?: CompressionStats;
   vehicle_vin?: string;  // Vehicle identifier for multi-vehicle support
+  log?: { message: string; log_type: 'info' | 'success' | 'error' | 'warning' };  // telemetry: per-packet log line
 }
 
+const textDecoder = new TextDecoder();
+
+// Large frames arrive zlib-compressed (first byte 0x78); JSON starts with '{'
+const decodeFrame = async (data: string | ArrayBuffer): Promise<string> => {
+  if (typeof data === 'string') {
+    return data;
+  }
+  if (new Uint8Array(data, 0, 1)[0] !== 0x78) {
+    return textDecoder.decode(data);
+  }
+  const stream = new Blob([data]).stream().pipeThrough(new DecompressionStream('deflate'));
+  return textDecoder.decode(await new Response(stream).arrayBuffer());
+};
+
 function App() {
   // Backend URL from environment variable (localhost for dev, Cloud Run for production)
   const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
@@ -93,6 +109,8 @@ function App() {
     }
 
     const ws = new WebSocket(`${WS_URL}/ws`);
+    // Server sends orjson-encoded UTF-8 JSON (zlib-compressed when large) as binary frames
+    ws.binaryType = 'arraybuffer';
     wsRef.current = ws;
 
     ws.onopen = () => {
@@ -102,8 +120,7 @@ function App() {
       addLog('=== Tesla Telemetry Dashboard Online ===', 'info');
     };
 
-    ws.onmessage = (event) => {
-      const message: WebSocketMessage = JSON.parse(event.data);
+    const handleMessage = (message: WebSocketMessage) => {
       console.log('[Dashboard] Received WebSocket message:', message.type, 'VIN:', message.vehicle_vin);
       
       // Update compression stats if available
@@ -145,6 +162,10 @@ function App() {
         setLastUpdate(new Date());
         addLog(`Loaded ${historyData.length} historical records`, 'info');
       } else if (message.type === 'telemetry') {
+        // Per-packet log line sent along with the reading
+        if (message.log) {
+          addLog(message.log.message, message.log.log_type);
+        }
         // Real-time update
         const newData = message.data as TelemetryData;
         // Add vehicle VIN to telemetry data if provided
@@ -167,6 +188,20 @@ function App() {
       }
     };
 
+    // Chain decodes so compressed frames are still handled in arrival order
+    let pending: Promise<void> = Promise.resolve();
+    ws.onmessage = (event) => {
+      pending = pending.then(async () => {
+        const message: WebSocketMessage = JSON.parse(await decodeFrame(event.data));
+        if (message.type === 'batch') {
+          // Server coalesces messages arriving close together into one frame
+          (message.items || []).forEach(handleMessage);
+        } else {
+          handleMessage(message);
+        }
+      }).catch((error) => console.error('Failed to decode message:', error));
+    };
+
     ws.onerror = (error) => {
       console.error('WebSocket error:', error);
       setIsConnected(false);
@@ -4,10 +4,18 @@ Generate varied telemetry data for multi-vehicle simulation
 Creates different JSONL files for each vehicle with realistic variations
 """
 
-import json
-import random
+import numpy as np
+import hashlib
+import mmap
+import msgspec
+import orjson
+import os
 import sys
+import multiprocessing
 from pathlib import Path
+from typing import Optional, Union
+
+Number = Union[int, float, None]
 
 # Vehicle profiles with different characteristics
 VEHICLE_PROFILES = {
@@ -43,74 +51,146 @@ VEHICLE_PROFILES = {
     }
 }
 
-def apply_vehicle_variance(data, profile):
-    """Apply realistic variance to telemetry data based on vehicle profile"""
-    varied = json.loads(json.dumps(data))  # Deep copy
-    
-    # Speed variance
-    if "drive_state" in varied and varied["drive_state"] and "speed" in varied["drive_state"]:
-        speed = varied["drive_state"]["speed"]
-        if speed is not None:
-            variance = random.uniform(-profile["speed_variance"], profile["speed_variance"])
-            varied["drive_state"]["speed"] = max(0, speed + variance)
-    
-    # Power variance
-    if "drive_state" in varied and varied["drive_state"] and "power" in varied["drive_state"]:
-        power = varied["drive_state"]["power"]
-        if power is not None:
-            variance = random.uniform(-profile["power_variance"], profile["power_variance"])
-            varied["drive_state"]["power"] = power + variance
+# Fixed odometer offset per vehicle (0-50k miles), derived from its name
+for _profile in VEHICLE_PROFILES.values():
+    _profile["_odometer_offset"] = sum(ord(c) for c in _profile["name"]) % 50000
+
+# Schema for the source log. Only the fields the edge logger replays are
+# decoded; everything else in the raw Tesla payload is skipped by the parser.
+# Missing/null fields are omitted from the decoded dicts.
+class DriveState(msgspec.Struct, omit_defaults=True):
+    timestamp: Number = None
+    speed: Number = None
+    power: Number = None
+    heading: Number = None
+
+class ChargeState(msgspec.Struct, omit_defaults=True):
+    battery_level: Number = None
+
+class VehicleState(msgspec.Struct, omit_defaults=True):
+    odometer: Number = None
+
+class Packet(msgspec.Struct, omit_defaults=True):
+    drive_state: Optional[DriveState] = None
+    charge_state: Optional[ChargeState] = None
+    vehicle_state: Optional[VehicleState] = None
+
+_packet_decoder = msgspec.json.Decoder(Packet)
+
+def _copy_record(data):
+    """Copy a record deep enough that variance can be applied in place"""
+    # Only these sub-dicts are mutated, so shallow-copy just them
+    varied = dict(data)
+    for key in ("drive_state", "charge_state", "vehicle_state"):
+        if varied.get(key):
+            varied[key] = dict(varied[key])
+    return varied
+
+def vehicle_seed(vin):
+    """Stable per-vehicle RNG seed (str hash() is randomized per process)"""
+    return int(hashlib.md5(vin.encode()).hexdigest(), 16) & 0xFFFFFFFF
+
+def _vary_field(records, section, key, transform):
+    """
+    Apply a vectorized transform to one numeric field across all records.
+    Records where the section or value is missing/None are left untouched.
+    """
+    targets = []
+    values = []
+    for record in records:
+        state = record.get(section)
+        if state and state.get(key) is not None:
+            targets.append(state)
+            values.append(state[key])
     
-    # Battery level variance (slight drift over time)
-    if "charge_state" in varied and varied["charge_state"] and "battery_level" in varied["charge_state"]:
-        battery = varied["charge_state"]["battery_level"]
-        if battery is not None:
-            # Slowly decrease battery (discharge simulation)
-            drift = random.uniform(-0.1, 0.05)
-            varied["charge_state"]["battery_level"] = max(10, min(100, battery + drift))
+    if not targets:
+        return
     
-    # Heading variance (realistic turning)
-    if "drive_state" in varied and varied["drive_state"] and "heading" in varied["drive_state"]:
-        heading = varied["drive_state"]["heading"]
-        if heading is not None:
-            variance = random.randint(-15, 15)
-            varied["drive_state"]["heading"] = (heading + variance) % 360
+    varied = transform(np.array(values, dtype=np.float64)).tolist()
+    for state, value in zip(targets, varied):
+        state[key] = value
+
+def apply_fleet_variance(records, profile, rng):
+    """
+    Apply realistic variance to a batch of telemetry records based on the
+    vehicle profile (speed, power, battery drift, heading, odometer offset).
+    Pass a per-vehicle np.random.Generator as rng for reproducible output.
+    Returns varied copies; the input records are not modified.
+    """
+    varied = [_copy_record(r) for r in records]
+    speed_variance = profile["speed_variance"]
+    power_variance = profile["power_variance"]
+    offset = profile["_odometer_offset"]
     
-    # Odometer offset (each vehicle has different mileage)
-    if "vehicle_state" in varied and varied["vehicle_state"] and "odometer" in varied["vehicle_state"]:
-        odometer = varied["vehicle_state"]["odometer"]
-        if odometer is not None:
-            # Add random offset based on vehicle (0-50k miles)
-            vehicle_hash = sum(ord(c) for c in profile["name"])
-            offset = (vehicle_hash % 50000)
-            varied["vehicle_state"]["odometer"] = odometer + offset
+    _vary_field(varied, "drive_state", "speed",
+                lambda v: np.maximum(v + rng.uniform(-speed_variance, speed_variance, v.size), 0))
+    _vary_field(varied, "drive_state", "power",
+                lambda v: v + rng.uniform(-power_variance, power_variance, v.size))
+    _vary_field(varied, "charge_state", "battery_level",
+                lambda v: np.clip(v + rng.uniform(-0.1, 0.05, v.size), 10, 100))
+    _vary_field(varied, "drive_state", "heading",
+                lambda v: (v + rng.integers(-15, 16, v.size)) % 360)
+    _vary_field(varied, "vehicle_state", "odometer",
+                lambda v: v + offset)
     
     return varied
 
-def generate_vehicle_data(source_file, output_dir, vin, max_records=None):
+def load_source_records(source_file, max_records=None):
+    """
+    Parse the source JSONL once into plain dicts holding only the Packet
+    fields. Blank, malformed and schema-invalid lines are skipped.
+    """
+    records = []
+    with open(source_file, 'rb') as src:
+        if os.fstat(src.fileno()).st_size == 0:
+            return records  # mmap can't map an empty file
+        
+        # Memory-map the log so only the lines we actually parse are read in;
+        # msgspec decodes the raw bytes lines directly
+        with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while not (max_records and len(records) >= max_records):
+                line = mm.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    records.append(msgspec.to_builtins(_packet_decoder.decode(line)))
+                except msgspec.DecodeError:
+                    continue
+    return records
+
+def generate_vehicle_data(records, output_dir, vin):
     """Generate varied telemetry data for a specific vehicle"""
     profile = VEHICLE_PROFILES[vin]
     output_file = output_dir / f"tesla_log_{vin}.jsonl"
     
+    # Seed per vehicle so output is reproducible regardless of which worker
+    # process runs it
+    rng = np.random.default_rng(vehicle_seed(vin))
+    
     print(f"Generating data for {profile['name']} (VIN: {vin[-6:]})...")
     
-    with open(source_file, 'r') as src, open(output_file, 'w') as dst:
-        count = 0
-        for line in src:
-            if max_records and count >= max_records:
-                break
-            
-            try:
-                data = json.loads(line)
-                varied_data = apply_vehicle_variance(data, profile)
-                dst.write(json.dumps(varied_data) + '\n')
-                count += 1
-            except json.JSONDecodeError:
-                continue
+    with open(output_file, 'wb') as dst:
+        for varied_data in apply_fleet_variance(records, profile, rng):
+            dst.write(orjson.dumps(varied_data))
+            dst.write(b'\n')
     
+    count = len(records)
     print(f"  → Generated {count} records in {output_file.name}")
     return count
 
+# Source records shared with pool workers, set once per worker by the
+# initializer instead of being pickled with every task
+_worker_records = None
+
+def _init_worker(records):
+    global _worker_records
+    _worker_records = records
+
+def _generate_worker(output_dir, vin):
+    return generate_vehicle_data(_worker_records, output_dir, vin)
+
 def main():
     # Paths
     project_dir = Path(__file__).parent
@@ -133,11 +213,15 @@ def main():
     
     # Generate data for each vehicle
     max_records = 200  # Limit to 200 records per vehicle for testing
-    total = 0
+    records = load_source_records(source_file, max_records)
     
-    for vin, profile in VEHICLE_PROFILES.items():
-        count = generate_vehicle_data(source_file, vehicle_data_dir, vin, max_records)
-        total += count
+    # Vehicles are independent, so generate them in parallel
+    jobs = [(vehicle_data_dir, vin) for vin in VEHICLE_PROFILES]
+    processes = min(len(VEHICLE_PROFILES), os.cpu_count() or 1)
+    with multiprocessing.Pool(processes=processes, initializer=_init_worker,
+                              initargs=(records,)) as pool:
+        counts = pool.starmap(_generate_worker, jobs)
+    total = sum(counts)
     
     print()
     print(f"✓ Successfully generated {total} total records for {len(VEHICLE_PROFILES)} vehicles")
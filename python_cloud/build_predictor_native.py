@@ -0,0 +1,26 @@
+"""
+Build the predictor_native extension (ahead-of-time compiled predictor kernel)
+
+Usage (from python_cloud/, requires numba at build time only):
+    python build_predictor_native.py
+
+predictor_kernel imports the resulting module when present, so the server
+starts without JIT compilation; otherwise it falls back to Numba JIT/NumPy.
+"""
+
+import os
+
+from numba.pycc import CC
+
+from predictor_kernel import _step, _step_batch, _update
+
+cc = CC('predictor_native')
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+
+cc.export('step', 'b1[:](f8[:], f8[:], b1[:], f8[:], f8)')(_step)
+cc.export('step_batch', 'b1[:, :](f8[:, :], f8[:], b1[:], f8[:], f8)')(_step_batch)
+cc.export('update', 'void(f8[:], f8[:], b1[:], f8)')(_update)
+
+if __name__ == "__main__":
+    cc.compile()
+    print(f"Built predictor_native in {cc.output_dir}")
@@ -4,9 +4,37 @@ Mirrors the C++ predictor logic to maintain synchronization
 """
 
 from dataclasses import dataclass
-from typing import Optional, Dict
+from typing import Optional, Dict, Mapping
+from types import MappingProxyType
 import time
 
+import numpy as np
+
+from predictor_kernel import step, step_batch, update
+
+
+# Field order of the state arrays below
+FIELDS = ('speed', 'power', 'battery', 'heading')
+
+# Decision bitmask: one bit per field in FIELDS order, then resync
+SPEED_BIT = 1 << 0
+POWER_BIT = 1 << 1
+BATTERY_BIT = 1 << 2
+HEADING_BIT = 1 << 3
+RESYNC_BIT = 1 << 4
+FIELDS_MASK = SPEED_BIT | POWER_BIT | BATTERY_BIT | HEADING_BIT
+
+
+# Shared read-only result for the common "transmit nothing" case
+_NO_TX = MappingProxyType({name: False for name in FIELDS + ('is_resync',)})
+
+
+def decode_mask(mask: int) -> Dict[str, bool]:
+    """Expand a decision bitmask into the per-field dict form"""
+    decisions = {name: bool(mask >> i & 1) for i, name in enumerate(FIELDS)}
+    decisions['is_resync'] = bool(mask & RESYNC_BIT)
+    return decisions
+
 
 @dataclass
 class PredictorConfig:
@@ -23,116 +51,120 @@ class TelemetryPredictor:
     """
     Server-side predictor that mirrors the C++ edge predictor.
     Used to reconstruct missing fields in compressed telemetry.
+
+    State is kept as length-4 arrays in FIELDS order so every field is
+    compared and smoothed in one vector operation.
     """
     
+    __slots__ = (
+        'config', '_alpha', '_one_minus_alpha', '_resync_ns', '_min_thr',
+        'predicted', 'has', 'threshold',
+        'total_readings', 'transmitted_readings', 'skipped_readings',
+        '_last_resync_ns',
+    )
+    
     def __init__(self, config: Optional[PredictorConfig] = None):
         self.config = config or PredictorConfig()
         
-        # Predicted values
-        self.predicted_speed = 0.0
-        self.predicted_power = 0.0
-        self.predicted_battery = 0.0
-        self.predicted_heading = 0.0
+        # Config values read on every packet, cached off the dataclass
+        self._alpha = self.config.alpha
+        self._one_minus_alpha = 1.0 - self.config.alpha
+        self._resync_ns = int(self.config.resync_interval * 1_000_000_000)
         
-        # State flags
-        self.has_speed = False
-        self.has_power = False
-        self.has_battery = False
-        self.has_heading = False
+        # Predicted values and state flags, one slot per field
+        self.predicted = np.zeros(4)
+        self.has = np.zeros(4, dtype=bool)
+        self.threshold = np.array([
+            self.config.speed_threshold,
+            self.config.power_threshold,
+            self.config.battery_threshold,
+            self.config.heading_threshold,
+        ])
+        self._min_thr = float(self.threshold.min())
         
         # Statistics
         self.total_readings = 0
         self.transmitted_readings = 0
         self.skipped_readings = 0
         
-        # Resync tracking
-        self.last_resync_time = time.time()
-    
-    def _exponential_smooth(self, actual: float, last_predicted: float) -> float:
-        """Apply exponential smoothing algorithm"""
-        return self.config.alpha * actual + (1.0 - self.config.alpha) * last_predicted
-    
-    def _should_transmit(self, actual: float, predicted: float, threshold: float, has_prediction: bool) -> bool:
-        """Determine if a value should be transmitted"""
-        if not has_prediction:
-            return True  # Always send first reading
-        return abs(actual - predicted) > threshold
-    
-    def should_transmit_packet(self, speed: float, power: float, battery: float, heading: float) -> Dict[str, bool]:
+        # Resync tracking (monotonic, so wall-clock jumps don't force resyncs)
+        self._last_resync_ns = time.monotonic_ns()
+    
+    def _check_resync(self) -> bool:
+        """Return True (and restart the interval) when a full resync is due"""
+        now_ns = time.monotonic_ns()
+        if now_ns - self._last_resync_ns >= self._resync_ns:
+            self._last_resync_ns = now_ns
+            return True
+        return False
+    
+    def _record_stats(self, transmitted: int, total: int) -> None:
+        self.total_readings += total
+        self.transmitted_readings += transmitted
+        self.skipped_readings += total - transmitted
+    
+    def should_transmit_mask(self, speed: float, power: float, battery: float, heading: float) -> int:
         """
         Determine which fields should be transmitted.
-        Returns dict with transmission decisions for each field.
+        Returns a bitmask of *_BIT flags (0 means skip the packet).
         """
-        self.total_readings += 1
-        current_time = time.time()
-        elapsed = current_time - self.last_resync_time
+        actual = np.array([speed, power, battery, heading], dtype=np.float64)
+        is_resync = self._check_resync()
         
-        # Check if resync is needed
-        if elapsed >= self.config.resync_interval:
-            decisions = {
-                'speed': True,
-                'power': True,
-                'battery': True,
-                'heading': True,
-                'is_resync': True
-            }
-            self.last_resync_time = current_time
-        else:
-            decisions = {
-                'speed': self._should_transmit(speed, self.predicted_speed, self.config.speed_threshold, self.has_speed),
-                'power': self._should_transmit(power, self.predicted_power, self.config.power_threshold, self.has_power),
-                'battery': self._should_transmit(battery, self.predicted_battery, self.config.battery_threshold, self.has_battery),
-                'heading': self._should_transmit(heading, self.predicted_heading, self.config.heading_threshold, self.has_heading),
-                'is_resync': False
-            }
+        # Steady state: if the summed error is under the smallest threshold,
+        # no single field can exceed its own, so skip the per-field checks
+        if not is_resync and self.has.all() and np.abs(actual - self.predicted).sum() < self._min_thr:
+            self.predicted *= self._one_minus_alpha
+            self.predicted += self._alpha * actual
+            self._record_stats(0, 1)
+            return 0
         
-        # Update statistics
-        if any([decisions['speed'], decisions['power'], decisions['battery'], decisions['heading']]):
-            self.transmitted_readings += 1
-        else:
-            self.skipped_readings += 1
+        send = step(actual, self.predicted, self.has, self.threshold, self._alpha)
+        mask = int(np.packbits(send, bitorder='little')[0])
+        if is_resync:
+            mask = FIELDS_MASK | RESYNC_BIT
         
-        # Update predictions using exponential smoothing
-        self.predicted_speed = self._exponential_smooth(speed, self.predicted_speed if self.has_speed else speed)
-        self.predicted_power = self._exponential_smooth(power, self.predicted_power if self.has_power else power)
-        self.predicted_battery = self._exponential_smooth(battery, self.predicted_battery if self.has_battery else battery)
-        self.predicted_heading = self._exponential_smooth(heading, self.predicted_heading if self.has_heading else heading)
+        self._record_stats(1 if mask else 0, 1)
+        return mask
+    
+    def should_transmit_packet(self, speed: float, power: float, battery: float, heading: float) -> Mapping[str, bool]:
+        """
+        Determine which fields should be transmitted.
+        Returns dict with transmission decisions for each field
+        (a shared read-only mapping when nothing is transmitted).
+        """
+        mask = self.should_transmit_mask(speed, power, battery, heading)
+        return decode_mask(mask) if mask else _NO_TX
+    
+    def should_transmit_batch(self, vals: np.ndarray) -> np.ndarray:
+        """
+        Score an (N, 4) block of readings in FIELDS order.
+        Returns a boolean (N, 4) mask of fields that should be transmitted.
+        Equivalent to calling should_transmit_packet once per row.
+        """
+        vals = np.ascontiguousarray(vals, dtype=np.float64).reshape(-1, 4)
+        if len(vals) == 0:
+            return np.zeros((0, 4), dtype=bool)
         
-        # Mark that we have predictions now
-        self.has_speed = self.has_power = self.has_battery = self.has_heading = True
+        send = step_batch(vals, self.predicted, self.has, self.threshold, self._alpha)
+        if self._check_resync():
+            send[0] = True
         
-        return decisions
+        self._record_stats(int(send.any(axis=1).sum()), len(vals))
+        return send
     
-    def update_with_actual(self, speed: Optional[float] = None, power: Optional[float] = None, 
-                          battery: Optional[float] = None, heading: Optional[float] = None):
+    def update_with_actual(self, vals: np.ndarray):
         """
         Update predictor with actual values received from client.
-        Only updates fields that were transmitted (not None).
+        vals holds the four fields in FIELDS order, NaN for fields that
+        were not transmitted; only the transmitted ones are updated.
         """
-        if speed is not None:
-            self.predicted_speed = self._exponential_smooth(speed, self.predicted_speed if self.has_speed else speed)
-            self.has_speed = True
-        
-        if power is not None:
-            self.predicted_power = self._exponential_smooth(power, self.predicted_power if self.has_power else power)
-            self.has_power = True
-        
-        if battery is not None:
-            self.predicted_battery = self._exponential_smooth(battery, self.predicted_battery if self.has_battery else battery)
-            self.has_battery = True
-        
-        if heading is not None:
-            self.predicted_heading = self._exponential_smooth(heading, self.predicted_heading if self.has_heading else heading)
-            self.has_heading = True
+        vals = np.ascontiguousarray(vals, dtype=np.float64)
+        update(vals, self.predicted, self.has, self._alpha)
     
     def get_predicted_values(self) -> Dict[str, float]:
         """Get current predicted values for reconstruction"""
-        return {
-            'speed': self.predicted_speed,
-            'power': self.predicted_power,
-            'battery': self.predicted_battery,
-            'heading': self.predicted_heading
-        }
+        return dict(zip(FIELDS, self.predicted.tolist()))
     
     def get_compression_stats(self) -> Dict[str, any]:
         """Get compression statistics"""
@@ -154,14 +186,11 @@ class TelemetryPredictor:
     
     def reset(self):
         """Reset predictor state"""
-        self.has_speed = False
-        self.has_power = False
-        self.has_battery = False
-        self.has_heading = False
+        self.has[:] = False
         self.total_readings = 0
         self.transmitted_readings = 0
         self.skipped_readings = 0
-        self.last_resync_time = time.time()
+        self._last_resync_ns = time.monotonic_ns()
 
 
 # Test scenarios
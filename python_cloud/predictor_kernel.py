@@ -0,0 +1,105 @@
+"""
+Predictor Kernel - compiled exponential-smoothing / threshold step
+Prefers the ahead-of-time built predictor_native extension, then Numba JIT,
+then an equivalent NumPy implementation
+"""
+
+import numpy as np
+
+# Numba JIT (optional)
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def _step(actual, predicted, has_mask, threshold, alpha):
+    """
+    Score one reading and advance the prediction in place.
+    Returns the per-field transmit decisions.
+    """
+    decisions = np.empty(actual.shape[0], dtype=np.bool_)
+    for i in range(actual.shape[0]):
+        diff = abs(actual[i] - predicted[i])
+        decisions[i] = (not has_mask[i]) or diff > threshold[i]
+        base = predicted[i] if has_mask[i] else actual[i]
+        predicted[i] = alpha * actual[i] + (1.0 - alpha) * base
+        has_mask[i] = True
+    return decisions
+
+
+def _step_batch(vals, predicted, has_mask, threshold, alpha):
+    """Run step() over each row of an (N, 4) block"""
+    decisions = np.empty(vals.shape, dtype=np.bool_)
+    for n in range(vals.shape[0]):
+        for i in range(vals.shape[1]):
+            actual = vals[n, i]
+            diff = abs(actual - predicted[i])
+            decisions[n, i] = (not has_mask[i]) or diff > threshold[i]
+            base = predicted[i] if has_mask[i] else actual
+            predicted[i] = alpha * actual + (1.0 - alpha) * base
+            has_mask[i] = True
+    return decisions
+
+
+def _update(actual, predicted, has_mask, alpha):
+    """
+    Smooth transmitted values into the prediction in place.
+    NaN entries in actual (fields not transmitted) are left unchanged.
+    """
+    for i in range(actual.shape[0]):
+        value = actual[i]
+        if value != value:  # NaN
+            continue
+        base = predicted[i] if has_mask[i] else value
+        predicted[i] = alpha * value + (1.0 - alpha) * base
+        has_mask[i] = True
+
+
+def _step_numpy(actual, predicted, has_mask, threshold, alpha):
+    """NumPy equivalent of _step for when no compiled kernel is available"""
+    decisions = ~has_mask | (np.abs(actual - predicted) > threshold)
+    base = np.where(has_mask, predicted, actual)
+    predicted[:] = alpha * actual + (1.0 - alpha) * base
+    has_mask[:] = True
+    return decisions
+
+
+def _update_numpy(actual, predicted, has_mask, alpha):
+    """NumPy equivalent of _update"""
+    mask = ~np.isnan(actual)
+    base = np.where(has_mask, predicted, actual)
+    np.copyto(predicted, alpha * actual + (1.0 - alpha) * base, where=mask)
+    has_mask |= mask
+
+
+def _step_batch_numpy(vals, predicted, has_mask, threshold, alpha):
+    """NumPy equivalent of _step_batch"""
+    decisions = np.empty(vals.shape, dtype=bool)
+    for n in range(vals.shape[0]):
+        decisions[n] = _step_numpy(vals[n], predicted, has_mask, threshold, alpha)
+    return decisions
+
+
+try:
+    # Built by build_predictor_native.py; no JIT warmup at startup
+    from predictor_native import step, step_batch, update
+    KERNEL = "aot"
+except ImportError:
+    if NUMBA_AVAILABLE:
+        step = njit(cache=True, fastmath=True)(_step)
+        step_batch = njit(cache=True, fastmath=True)(_step_batch)
+        # No fastmath here: it lets LLVM assume NaN never occurs
+        update = njit(cache=True)(_update)
+        KERNEL = "jit"
+
+        # Compile now rather than on the first telemetry packet
+        step(np.zeros(4), np.zeros(4), np.zeros(4, dtype=np.bool_), np.ones(4), 0.3)
+        step_batch(np.zeros((1, 4)), np.zeros(4), np.zeros(4, dtype=np.bool_), np.ones(4), 0.3)
+        update(np.zeros(4), np.zeros(4), np.zeros(4, dtype=np.bool_), 0.3)
+    else:
+        step = _step_numpy
+        step_batch = _step_batch_numpy
+        update = _update_numpy
+        KERNEL = "numpy"
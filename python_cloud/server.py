@@ -1,28 +1,70 @@
+import os
+# Use the native upb protobuf parser (must be set before telemetry_pb2 loads)
+PROTOBUF_EXPLICIT_PYTHON = os.environ.get("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION") == "python"
+os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "upb")
+
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.responses import Response
+from starlette.routing import Route
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
 import telemetry_pb2  # Generated protobuf file
-import json
+from google.protobuf.internal import api_implementation
+import orjson
 from datetime import datetime
 import uvicorn
 import subprocess
 import asyncio
-import os
+import importlib.util
 import sys
 import threading
-from predictor import TelemetryPredictor
+import time
+import queue
+import math
+import logging
+import zlib
+from collections import OrderedDict
+import numpy as np
+from predictor import (
+    TelemetryPredictor, SPEED_BIT, POWER_BIT, BATTERY_BIT, HEADING_BIT, FIELDS_MASK
+)
+from telemetry_ring import TelemetryRing
+
+logger = logging.getLogger(__name__)
+
+# Refuse to silently parse every packet with the pure-Python protobuf runtime
+# (10-100x slower); set PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=python to opt in
+if api_implementation.Type() == "python" and not PROTOBUF_EXPLICIT_PYTHON:
+    raise RuntimeError(
+        "protobuf is using the pure-Python backend; install protobuf>=4.21 "
+        "for the native upb parser"
+    )
 
 # Kafka consumer (optional)
 try:
-    from confluent_kafka import Consumer, KafkaError, KafkaException
+    from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
     KAFKA_AVAILABLE = True
 except ImportError:
     KAFKA_AVAILABLE = False
     print("[KAFKA] confluent-kafka not installed, Kafka consumer disabled")
 
+# Faster event loop / HTTP parser for uvicorn (optional); uvicorn imports
+# them itself, so only check that they are installed
+UVLOOP_AVAILABLE = importlib.util.find_spec("uvloop") is not None
+HTTPTOOLS_AVAILABLE = importlib.util.find_spec("httptools") is not None
+
+# Fast payload hashing for duplicate detection (optional)
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
 # Add parent directory to path for database imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-from database.supabase_client import get_supabase_client
+from database.supabase_client import get_supabase_client, TELEMETRY_FLUSH_INTERVAL
 
 app = FastAPI()
 
@@ -50,6 +92,15 @@ if USE_SUPABASE:
 
 script_task = None
 
+# Batched Supabase uploads, written from the main event loop one flush at a
+# time. The queue is bounded, so a slow Supabase leaves rows in the client's
+# buffer instead of piling up work
+UPLOAD_QUEUE_SIZE = 16
+upload_loop = None
+upload_queue = None
+upload_worker_task = None
+upload_timer_task = None
+
 # Enable CORS for React
 app.add_middleware(
     CORSMiddleware,
@@ -59,49 +110,224 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory storage (simple list for demo)
-telemetry_buffer: List[dict] = []
+# Compress larger HTTP responses such as /status for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# In-memory storage (columnar ring overwrites the oldest record on append)
 MAX_BUFFER_SIZE = 1000
+telemetry_buffer = TelemetryRing(MAX_BUFFER_SIZE)
+
+
+def recent_telemetry(n: int) -> List[dict]:
+    """Return the last n buffered records, oldest first"""
+    return telemetry_buffer.recent(n)
+
+
+# Frames sent to every new WebSocket client. The history frame and its
+# "Loaded N" log line are rebuilt on the first connect after the buffer
+# changes instead of on every connect (None = stale)
+HISTORY_SIZE = 100
+CONNECTED_FRAME = orjson.dumps({
+    "type": "log",
+    "message": "Connected to telemetry server",
+    "log_type": "success"
+})
+history_frame = None
+
+
+# Frames larger than this are zlib-compressed once on the server and sent
+# to every client as-is (the dashboard inflates them), instead of each
+# connection re-deflating the same bytes with permessage-deflate
+FRAME_COMPRESS_MIN_BYTES = 1024
+
+
+def encode_frame(message: dict) -> bytes:
+    """Serialize a WebSocket message, zlib-compressing large payloads"""
+    payload = orjson.dumps(message)
+    if len(payload) > FRAME_COMPRESS_MIN_BYTES:
+        payload = zlib.compress(payload, 1)
+    return payload
+
+
+def get_history_frames() -> tuple:
+    """Return the cached (history, loaded-log) frames, rebuilding if stale"""
+    global history_frame
+    frames = history_frame
+    if frames is None:
+        records = recent_telemetry(HISTORY_SIZE)
+        frames = (
+            encode_frame({"type": "history", "data": records}),
+            encode_frame({
+                "type": "log",
+                "message": f"Loaded {len(records)} historical telemetry records",
+                "log_type": "info"
+            }),
+        )
+        history_frame = frames
+    return frames
 
 # Kafka configuration
 KAFKA_ENABLED = os.getenv("KAFKA_BOOTSTRAP_SERVERS") is not None and KAFKA_AVAILABLE
 KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
 KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "telemetry-raw")
 KAFKA_CONSUMER_GROUP = os.getenv("KAFKA_CONSUMER_GROUP", "telemetry-processors")
-kafka_consumer_thread = None
+KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", "500"))
+kafka_consumer_task = None
 kafka_consumer_running = False
+# librdkafka calls block, so the consumer lives on one dedicated thread
+kafka_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kafka")
+
+
+# Bytes of logger stdout read per wakeup
+SCRIPT_READ_SIZE = 65536
+
+# Hot-path log lines go through a bounded queue to a writer thread, so
+# stdout I/O never blocks the event loop (lines are dropped when full)
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 128
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+
+
+def log_line(message: str):
+    """Queue a line for stdout without blocking the caller"""
+    try:
+        log_queue.put_nowait(message)
+    except queue.Full:
+        pass
+
+
+def log_writer_loop():
+    """Write queued log lines to stdout in batches"""
+    while True:
+        lines = [log_queue.get()]
+        while len(lines) < LOG_BATCH_SIZE:
+            try:
+                lines.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
+
+log_writer_thread = threading.Thread(target=log_writer_loop, daemon=True)
+log_writer_thread.start()
+
+
+# Broadcast coalescing: per-record telemetry and log messages arriving
+# within this window are sent to clients as one batch frame
+COALESCE_INTERVAL = 0.02  # seconds
+COALESCE_MAX_BATCH = 128
+# Bound on messages waiting for the flusher; the oldest are dropped when a
+# stalled client backs it up, so ingest never waits on WebSocket fan-out
+COALESCE_QUEUE_SIZE = 10000
+
+# Clients written concurrently per gather() before yielding to the loop
+BROADCAST_CHUNK_SIZE = 50
 
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        # Immutable snapshot replaced on membership change (copy-on-write),
+        # so broadcasts can iterate it without copying or locking
+        self.active_connections: Tuple[WebSocket, ...] = ()
+        self._loop = None
+        self._pending = None
+        self._flusher_task = None
+
+    def start(self):
+        """Start the coalescing flusher on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._pending = asyncio.Queue(maxsize=COALESCE_QUEUE_SIZE)
+        self._start_flusher()
+
+    def _start_flusher(self):
+        self._flusher_task = asyncio.create_task(self._flusher())
+        self._flusher_task.add_done_callback(self._flusher_done)
+
+    def _flusher_done(self, task: asyncio.Task):
+        """Restart the flusher if it died, so fan-out never stops silently"""
+        if task.cancelled() or task is not self._flusher_task:
+            return
+        logger.error("WebSocket flusher stopped unexpectedly, restarting",
+                     exc_info=task.exception())
+        self._start_flusher()
+
+    async def stop(self):
+        if self._flusher_task:
+            task, self._flusher_task = self._flusher_task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections = (*self.active_connections, websocket)
         print(f"[WS] Client connected. Total connections: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        self.active_connections = tuple(c for c in self.active_connections if c is not websocket)
         print(f"[WS] Client disconnected. Total connections: {len(self.active_connections)}")
 
     async def broadcast(self, message: dict):
         """Broadcast message to all connected clients"""
-        dead_connections = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f"[WS ERROR] Failed to send: {e}")
-                dead_connections.append(connection)
+        # Serialize (and compress) once and write to every client concurrently
+        payload = encode_frame(message)
+        connections = self.active_connections
+        dead = set()
+        
+        # Send in chunks, yielding between them so a large fan-out doesn't
+        # hold the event loop for one long stretch
+        for start in range(0, len(connections), BROADCAST_CHUNK_SIZE):
+            chunk = connections[start:start + BROADCAST_CHUNK_SIZE]
+            results = await asyncio.gather(
+                *(connection.send_bytes(payload) for connection in chunk),
+                return_exceptions=True
+            )
+            for conn, result in zip(chunk, results):
+                if isinstance(result, Exception):
+                    log_line(f"[WS ERROR] Failed to send: {result}")
+                    dead.add(conn)
+            if start + BROADCAST_CHUNK_SIZE < len(connections):
+                await asyncio.sleep(0)
         
         # Clean up dead connections
-        for conn in dead_connections:
-            self.active_connections.remove(conn)
+        if dead:
+            self.active_connections = tuple(c for c in self.active_connections if c not in dead)
     
+    async def broadcast_coalesced(self, message: dict):
+        """Queue a message for the next coalesced batch frame"""
+        if self._loop is None:
+            # Flusher not started yet (before startup)
+            await self.broadcast(message)
+            return
+        self._enqueue(message)
+
+    def _enqueue(self, message: dict):
+        """Queue a message on the loop thread, dropping the oldest if full"""
+        if self._pending.full():
+            self._pending.get_nowait()
+        self._pending.put_nowait(message)
+
+    async def _flusher(self):
+        """Drain queued messages and send them as one frame per window"""
+        while True:
+            batch = [await self._pending.get()]
+            await asyncio.sleep(COALESCE_INTERVAL)
+            while len(batch) < COALESCE_MAX_BATCH and not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+            
+            try:
+                if len(batch) == 1:
+                    await self.broadcast(batch[0])
+                else:
+                    await self.broadcast({"type": "batch", "items": batch})
+            except Exception:
+                # Drop this batch but keep flushing the ones behind it
+                logger.exception("Failed to broadcast %d coalesced messages", len(batch))
+
     async def broadcast_log(self, message: str, log_type: str = "info"):
         """Broadcast log message to all connected clients"""
-        await self.broadcast({
+        # Same queue as telemetry, so a log line never overtakes the records before it
+        await self.broadcast_coalesced({
             "type": "log",
             "message": message,
             "log_type": log_type
@@ -114,90 +340,296 @@ async def stream_script_output():
     
     if script_process and script_process.stdout:
         try:
+            # Read whatever output is available in one go and send all of its
+            # lines in one frame; a trailing partial line waits for the rest
+            partial = b""
             while True:
-                line = await script_process.stdout.readline()
-                if not line:
+                chunk = await script_process.stdout.read(SCRIPT_READ_SIZE)
+                if not chunk:
                     break
-                decoded_line = line.decode('utf-8').strip()
-                if decoded_line:
-                    await manager.broadcast_log(decoded_line, "info")
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()
+                await broadcast_script_lines(lines)
+            await broadcast_script_lines([partial])
         except asyncio.CancelledError:
             pass
         except Exception as e:
             await manager.broadcast_log(f"Error reading script output: {e}", "error")
 
 
+async def broadcast_script_lines(lines: List[bytes]):
+    """Broadcast non-empty script output lines as one log or batch frame"""
+    messages = [
+        {"type": "log", "message": decoded, "log_type": "info"}
+        for decoded in (line.decode('utf-8', 'replace').strip() for line in lines)
+        if decoded
+    ]
+    if len(messages) == 1:
+        await manager.broadcast(messages[0])
+    elif messages:
+        await manager.broadcast({"type": "batch", "items": messages})
+
+
 manager = ConnectionManager()
 
 
+def schedule_supabase_flush():
+    """Hand buffered telemetry rows to the upload worker on the main event loop"""
+    if upload_loop is None:
+        # Upload worker not started yet (before startup)
+        for vehicle_id, rows in supabase.take_pending().items():
+            supabase.insert_telemetry_batch(vehicle_id, rows)
+        return
+    if upload_queue.full():
+        # Uploads are backed up; keep the rows buffered for the next flush
+        return
+    upload_queue.put_nowait(supabase.take_pending())
+
+
+async def supabase_flush_timer():
+    """Flush buffered rows on an interval, so they go out even when traffic stops"""
+    while True:
+        await asyncio.sleep(max(TELEMETRY_FLUSH_INTERVAL, 0.1))
+        if supabase.flush_due():
+            schedule_supabase_flush()
+
+
+async def supabase_upload_worker():
+    """Insert queued telemetry batches, one flush at a time"""
+    while True:
+        batches = await upload_queue.get()
+        if batches is None:
+            # Shutdown sentinel: everything queued before it has been written
+            return
+        # The client caps concurrent inserts at UPLOAD_CONCURRENCY
+        await asyncio.gather(*(
+            supabase.insert_telemetry_batch_async(vehicle_id, rows)
+            for vehicle_id, rows in batches.items()
+        ), return_exceptions=True)
+
+
+# Payloads larger than this are parsed on a worker thread so a big upload
+# doesn't stall the event loop; small ones are cheaper to parse inline
+PARSE_OFFLOAD_BYTES = 4096
+parse_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pb-parse")
+
+
+# Parsed messages are recycled instead of allocated per request;
+# ParseFromString clears a message before filling it
+message_pools = {}
+
+
+def acquire_message(message_class):
+    """Take a pooled message of message_class, or make a new one"""
+    pool = message_pools.get(message_class)
+    if pool is not None:
+        try:
+            return pool.get_nowait()
+        except queue.Empty:
+            pass
+    return message_class()
+
+
+def release_message(message):
+    """Return a message to its pool once its fields have been read"""
+    pool = message_pools.get(type(message))
+    if pool is None:
+        pool = message_pools.setdefault(type(message), queue.SimpleQueue())
+    pool.put(message)
+
+
+async def parse_protobuf(message_class, data: bytes):
+    """Parse into a pooled message, off the event loop for large payloads"""
+    message = acquire_message(message_class)
+    if len(data) <= PARSE_OFFLOAD_BYTES:
+        message.ParseFromString(data)
+    else:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(parse_pool, message.ParseFromString, data)
+    return message
+
+
+def decode_compressed(data: bytes) -> Tuple:
+    """
+    Parse a CompressedVehicleData payload into a flat tuple:
+    (sent_mask, timestamp, speed, battery, power, odometer, heading, is_resync)
+    Fields that were not transmitted come back as None.
+    """
+    message = acquire_message(telemetry_pb2.CompressedVehicleData)
+    try:
+        message.ParseFromString(data)
+        has_field = message.HasField
+        sent_mask = 0
+        speed = battery = power = heading = None
+        if has_field('vehicle_speed'):
+            speed = message.vehicle_speed
+            sent_mask |= SPEED_BIT
+        if has_field('power_kw'):
+            power = message.power_kw
+            sent_mask |= POWER_BIT
+        if has_field('battery_level'):
+            battery = message.battery_level
+            sent_mask |= BATTERY_BIT
+        if has_field('heading'):
+            heading = message.heading
+            sent_mask |= HEADING_BIT
+        return (sent_mask, message.timestamp, speed, battery, power,
+                message.odometer, heading, message.is_resync)
+    finally:
+        # Back to the pool even when a malformed payload fails to parse
+        release_message(message)
+
+
+# Hash of the last raw payload per VIN, so a back-to-back resend of the
+# same bytes skips parsing, predictor updates and broadcast entirely.
+# Kept for the most recently seen MAX_HASHED_VINS VINs only, since any
+# client can send new ones
+payload_hash = xxhash.xxh3_64_intdigest if XXHASH_AVAILABLE else hash
+last_payload_hash = OrderedDict()
+MAX_HASHED_VINS = 4096
+
+
+def is_duplicate_payload(vehicle_vin: str, data: bytes) -> bool:
+    """Return True if data is identical to the previous payload for this VIN"""
+    digest = payload_hash(data)
+    if last_payload_hash.get(vehicle_vin) == digest:
+        last_payload_hash.move_to_end(vehicle_vin)
+        return True
+    last_payload_hash[vehicle_vin] = digest
+    last_payload_hash.move_to_end(vehicle_vin)
+    if len(last_payload_hash) > MAX_HASHED_VINS:
+        last_payload_hash.popitem(last=False)
+    return False
+
+
+# Formatted date/time prefix for the current second: [epoch_second, prefix]
+_ts_cache = [0, ""]
+
+
+def format_received(received_us: int) -> str:
+    """Local ISO-8601 timestamp; the date/time part is formatted once per second"""
+    sec, micros = divmod(received_us, 1_000_000)
+    if sec != _ts_cache[0]:
+        _ts_cache[0] = sec
+        _ts_cache[1] = datetime.fromtimestamp(sec).isoformat()
+    return f"{_ts_cache[1]}.{micros:06d}"
+
+
+# compression_stats changes slowly, so the dict embedded in each telemetry
+# message is recomputed at most every STATS_REFRESH_INTERVAL seconds
+STATS_REFRESH_INTERVAL = 0.5
+_stats_cache = [0.0, None]
+
+
+def compression_stats() -> dict:
+    """Recent g_predictor.get_compression_stats(), refreshed on an interval"""
+    now = time.monotonic()
+    if _stats_cache[1] is None or now - _stats_cache[0] >= STATS_REFRESH_INTERVAL:
+        _stats_cache[0] = now
+        _stats_cache[1] = g_predictor.get_compression_stats()
+    return _stats_cache[1]
+
+
+# VIN -> (vehicle_id, expiry). Known vehicles are cached for good; unknown
+# VINs are remembered as None and re-queried after VIN_MISS_TTL seconds
+vehicle_id_cache = {}
+VIN_MISS_TTL = 60.0
+
+
+def lookup_vehicle_id(vehicle_vin: str):
+    """Return the Supabase vehicle ID for a VIN, querying only on a cache miss"""
+    cached = vehicle_id_cache.get(vehicle_vin)
+    if cached is not None:
+        vehicle_id, expires = cached
+        if expires is None or time.monotonic() < expires:
+            return vehicle_id
+    
+    vehicle_info = supabase.get_vehicle_by_vin(vehicle_vin)
+    if vehicle_info:
+        vehicle_id_cache[vehicle_vin] = (vehicle_info['id'], None)
+        return vehicle_info['id']
+    
+    log_line(f"[WARNING] Unknown vehicle VIN: {vehicle_vin}")
+    vehicle_id_cache[vehicle_vin] = (None, time.monotonic() + VIN_MISS_TTL)
+    return None
+
+
+# Log labels for transmitted fields, in log order
+SENT_LABELS = (
+    (SPEED_BIT, 'Speed'),
+    (BATTERY_BIT, 'Battery'),
+    (POWER_BIT, 'Power'),
+    (HEADING_BIT, 'Heading'),
+)
+
+
 async def process_telemetry_data(data: bytes, vehicle_vin: str, is_compressed: bool = True):
     """Process telemetry data (from Kafka or HTTP) and store/broadcast it"""
+    global history_frame
+    
     try:
+        # Arrival time, kept as integer microseconds for the ring buffer
+        received_us = time.time_ns() // 1000
+        received_at = format_received(received_us)
+        
         if is_compressed:
-            # Parse compressed protobuf
-            compressed_data = telemetry_pb2.CompressedVehicleData()
-            compressed_data.ParseFromString(data)
+            # Decode straight to a tuple; absent fields come back as None
+            (sent_mask, timestamp, speed, battery, power,
+             odometer, heading, is_resync) = decode_compressed(data)
             
-            # Track compression statistics
-            g_predictor.total_readings += 4  # 4 fields: speed, power, battery, heading
-            fields_transmitted = 0
-            if compressed_data.HasField('vehicle_speed'):
-                fields_transmitted += 1
-            if compressed_data.HasField('power_kw'):
-                fields_transmitted += 1
-            if compressed_data.HasField('battery_level'):
-                fields_transmitted += 1
-            if compressed_data.HasField('heading'):
-                fields_transmitted += 1
+            predictor = g_predictor
             
-            g_predictor.transmitted_readings += fields_transmitted
-            g_predictor.skipped_readings += (4 - fields_transmitted)
+            # Track compression statistics
+            fields_transmitted = bin(sent_mask).count('1')
+            predictor.total_readings += 4  # 4 fields: speed, power, battery, heading
+            predictor.transmitted_readings += fields_transmitted
+            predictor.skipped_readings += 4 - fields_transmitted
             
-            # Reconstruct full telemetry using predictor
-            predicted = g_predictor.get_predicted_values()
+            # Update predictor with actual received values
+            nan = math.nan
+            actual = np.array([
+                nan if speed is None else speed,
+                nan if power is None else power,
+                nan if battery is None else battery,
+                nan if heading is None else heading,
+            ])
             
-            # Use received values if present, otherwise use predicted
-            speed = compressed_data.vehicle_speed if compressed_data.HasField('vehicle_speed') else predicted.get('speed', 0)
-            battery = compressed_data.battery_level if compressed_data.HasField('battery_level') else predicted.get('battery', 0)
-            power = compressed_data.power_kw if compressed_data.HasField('power_kw') else predicted.get('power', 0)
-            heading = compressed_data.heading if compressed_data.HasField('heading') else int(predicted.get('heading', 0))
+            # Reconstruct full telemetry using predictor (FIELDS order)
+            if sent_mask != FIELDS_MASK:
+                p_speed, p_power, p_battery, p_heading = predictor.predicted.tolist()
+                if speed is None:
+                    speed = p_speed
+                if battery is None:
+                    battery = p_battery
+                if power is None:
+                    power = p_power
+                if heading is None:
+                    heading = int(p_heading)
             
-            # Update predictor with actual received values
-            g_predictor.update_with_actual(
-                speed=compressed_data.vehicle_speed if compressed_data.HasField('vehicle_speed') else None,
-                battery=compressed_data.battery_level if compressed_data.HasField('battery_level') else None,
-                power=compressed_data.power_kw if compressed_data.HasField('power_kw') else None,
-                heading=float(compressed_data.heading) if compressed_data.HasField('heading') else None
-            )
+            predictor.update_with_actual(actual)
             
             # Build telemetry dict with reconstructed data
             telemetry_dict = {
-                "timestamp": compressed_data.timestamp,
+                "timestamp": timestamp,
                 "speed": speed,
                 "battery": battery,
                 "power": power,
-                "odometer": compressed_data.odometer,
+                "odometer": odometer,
                 "heading": heading,
-                "received_at": datetime.now().isoformat()
+                "received_at": received_at
             }
             
             # Log which fields were transmitted vs predicted
-            fields_sent = []
-            if compressed_data.HasField('vehicle_speed'): fields_sent.append('Speed')
-            if compressed_data.HasField('battery_level'): fields_sent.append('Battery')
-            if compressed_data.HasField('power_kw'): fields_sent.append('Power')
-            if compressed_data.HasField('heading'): fields_sent.append('Heading')
+            fields_sent = [label for bit, label in SENT_LABELS if sent_mask & bit]
             
             log_msg = f"[KAFKA] Received: {', '.join(fields_sent) if fields_sent else 'No updates'}"
-            if compressed_data.is_resync:
+            if is_resync:
                 log_msg += " [RESYNC]"
-            
-            await manager.broadcast_log(log_msg, "info")
+            log_type = "info"
             
         else:
             # Parse uncompressed protobuf (legacy support)
-            vehicle_data = telemetry_pb2.VehicleData()
-            vehicle_data.ParseFromString(data)
+            vehicle_data = await parse_protobuf(telemetry_pb2.VehicleData, data)
             
             # Convert to dict for JSON broadcasting
             telemetry_dict = {
@@ -207,50 +639,56 @@ async def process_telemetry_data(data: bytes, vehicle_vin: str, is_compressed: b
                 "power": vehicle_data.power_kw,
                 "odometer": vehicle_data.odometer,
                 "heading": vehicle_data.heading,
-                "received_at": datetime.now().isoformat()
+                "received_at": received_at
             }
+            release_message(vehicle_data)
             
-            await manager.broadcast_log(
-                f"[KAFKA] ✓ Received: Speed={vehicle_data.vehicle_speed} mph, Battery={vehicle_data.battery_level}%, Power={vehicle_data.power_kw} kW",
-                "success"
-            )
+            log_msg = f"[KAFKA] ✓ Received: Speed={telemetry_dict['speed']} mph, Battery={telemetry_dict['battery']}%, Power={telemetry_dict['power']} kW"
+            log_type = "success"
         
         # Lookup vehicle ID for this VIN
         vehicle_id = VEHICLE_ID  # Use default cached ID
         if USE_SUPABASE and vehicle_vin != "5YJ3E1EA1KF000001":
             # Lookup vehicle by VIN if not the default
-            vehicle_info = supabase.get_vehicle_by_vin(vehicle_vin)
-            if vehicle_info:
-                vehicle_id = vehicle_info['id']
-            else:
-                print(f"[WARNING] Unknown vehicle VIN: {vehicle_vin}")
-                vehicle_id = None
+            vehicle_id = lookup_vehicle_id(vehicle_vin)
         
-        # Store in memory (keep last MAX_BUFFER_SIZE records)
-        telemetry_buffer.append(telemetry_dict)
-        if len(telemetry_buffer) > MAX_BUFFER_SIZE:
-            telemetry_buffer.pop(0)
+        # Store in memory (ring keeps last MAX_BUFFER_SIZE records)
+        telemetry_buffer.append(telemetry_dict, received_us)
+        history_frame = None
         
-        # Store in Supabase if enabled
+        # Queue for batched Supabase insert if enabled
         if USE_SUPABASE and vehicle_id:
-            supabase.insert_telemetry(vehicle_id, telemetry_dict)
+            if supabase.queue_telemetry(vehicle_id, telemetry_dict):
+                schedule_supabase_flush()
         
-        # Broadcast to all connected WebSocket clients
-        await manager.broadcast({
+        # Broadcast to all connected WebSocket clients (coalesced); the
+        # per-packet log line rides in the same message
+        await manager.broadcast_coalesced({
             "type": "telemetry",
             "data": telemetry_dict,
             "vehicle_vin": vehicle_vin[-6:],  # Last 6 chars for privacy
-            "compression_stats": g_predictor.get_compression_stats()
+            "compression_stats": compression_stats(),
+            "log": {"message": log_msg, "log_type": log_type}
         })
         
         return True
     except Exception as e:
-        print(f"[ERROR] Failed to process telemetry: {e}")
+        log_line(f"[ERROR] Failed to process telemetry: {e}")
         await manager.broadcast_log(f"[ERROR] Failed to process telemetry: {e}", "error")
         return False
 
 
-@app.post("/telemetry")
+# /telemetry is a plain Starlette route: binary in, tiny JSON out, so it
+# skips FastAPI's dependency resolution and response model serialization
+TELEMETRY_OK_PREFIX = b'{"status":"ok","records_buffered":'
+TELEMETRY_DUP_PREFIX = b'{"status":"dup","records_buffered":'
+
+
+def buffered_response(prefix: bytes) -> Response:
+    """Status response with the current buffer size appended to a cached prefix"""
+    return Response(prefix + str(len(telemetry_buffer)).encode() + b"}", media_type="application/json")
+
+
 async def receive_telemetry(request: Request):
     """Receive protobuf binary data from C++ edge device via HTTP (fallback when Kafka not available)"""
     try:
@@ -263,93 +701,185 @@ async def receive_telemetry(request: Request):
         # Read binary protobuf data
         data = await request.body()
         
+        # Drop identical resends before parsing
+        if is_duplicate_payload(vehicle_vin, data):
+            return buffered_response(TELEMETRY_DUP_PREFIX)
+        
         # Process using shared function
         success = await process_telemetry_data(data, vehicle_vin, is_compressed)
         
         if success:
-        return {"status": "ok", "records_buffered": len(telemetry_buffer)}
+            return buffered_response(TELEMETRY_OK_PREFIX)
         else:
-            return {"status": "error", "message": "Failed to process telemetry"}
+            return Response(orjson.dumps({"status": "error", "message": "Failed to process telemetry"}), media_type="application/json")
         
     except Exception as e:
-        print(f"[ERROR] Failed to process telemetry: {e}")
+        log_line(f"[ERROR] Failed to process telemetry: {e}")
         await manager.broadcast_log(f"[ERROR] Failed to process telemetry: {e}", "error")
-        return {"status": "error", "message": str(e)}
+        return Response(orjson.dumps({"status": "error", "message": str(e)}), media_type="application/json")
+
+
+app.router.routes.append(Route("/telemetry", receive_telemetry, methods=["POST"]))
+
 
+def offset_list(offsets: dict) -> list:
+    """Convert {(topic, partition): offset} to TopicPartitions for commit()"""
+    return [TopicPartition(topic, partition, offset)
+            for (topic, partition), offset in offsets.items()]
 
-def kafka_consumer_loop():
-    """Kafka consumer running in background thread"""
+
+async def kafka_consumer_loop():
+    """
+    Kafka consumer running on the main event loop.
+    Blocking consume() calls run on a dedicated thread; the next batch is
+    in flight while the current one is processed, and messages stay in order.
+    """
     global kafka_consumer_running
     
-    if not KAFKA_ENABLED:
-        print("[KAFKA] Consumer disabled (KAFKA_BOOTSTRAP_SERVERS not set or library not available)")
-        return
-    
     print(f"[KAFKA] Starting consumer: brokers={KAFKA_BOOTSTRAP_SERVERS}, topic={KAFKA_TOPIC}, group={KAFKA_CONSUMER_GROUP}")
     
-    # Create a new event loop for this thread
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    loop = asyncio.get_running_loop()
     
     # Create consumer configuration
     conf = {
         'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
         'group.id': KAFKA_CONSUMER_GROUP,
         'auto.offset.reset': 'earliest',  # Start from beginning if no offset
-        'enable.auto.commit': True,
-        'auto.commit.interval.ms': 1000,
+        # Batches arrive lz4-compressed from the edge producer; librdkafka
+        # decompresses them transparently, no consumer setting needed
+        'enable.auto.commit': False,  # committed once per processed batch
+        # Let librdkafka prefetch ahead of consume() without waiting on
+        # fetch.min.bytes, so an idle stream is still delivered immediately
+        'fetch.wait.max.ms': 500,
+        'queued.max.messages.kbytes': 16384,
     }
     
     consumer = None
+    poll = None
+    # (topic, partition) -> offset after the last processed message, for
+    # messages processed since the last commit. Shared with the rebalance
+    # callbacks, which run on the kafka_pool thread inside consume()
+    pending_offsets = {}
+    assigned = set()
+    offsets_lock = threading.Lock()
+    
+    def take_offsets(partitions=None) -> dict:
+        """Remove and return pending offsets (only for partitions, if given)"""
+        with offsets_lock:
+            if partitions is None:
+                taken = pending_offsets.copy()
+                pending_offsets.clear()
+            else:
+                taken = {key: pending_offsets.pop(key) for key in partitions if key in pending_offsets}
+        return taken
+    
+    def on_assign(consumer, partitions):
+        with offsets_lock:
+            assigned.update((p.topic, p.partition) for p in partitions)
+    
+    def on_revoke(consumer, partitions):
+        """Commit what was processed for revoked partitions, then forget them"""
+        revoked = {(p.topic, p.partition) for p in partitions}
+        with offsets_lock:
+            assigned.difference_update(revoked)
+        offsets = take_offsets(revoked)
+        if offsets:
+            try:
+                consumer.commit(offsets=offset_list(offsets), asynchronous=False)
+            except KafkaException as e:
+                log_line(f"[KAFKA ERROR] Commit on revoke failed: {e}")
+    
     try:
         consumer = Consumer(conf)
-        consumer.subscribe([KAFKA_TOPIC])
+        consumer.subscribe([KAFKA_TOPIC], on_assign=on_assign, on_revoke=on_revoke)
         
         kafka_consumer_running = True
         print(f"[KAFKA] Consumer subscribed to topic: {KAFKA_TOPIC}")
         
+        # Consume up to KAFKA_BATCH_SIZE messages per call
+        poll = loop.run_in_executor(kafka_pool, consumer.consume, KAFKA_BATCH_SIZE, 0.5)
+        
         message_count = 0
         while kafka_consumer_running:
             try:
-                # Poll for messages (timeout 1 second)
-                msg = consumer.poll(timeout=1.0)
-                
-                if msg is None:
-                    continue
-                
-                if msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
-                        # End of partition event - not an error
-                        continue
-                    else:
-                        print(f"[KAFKA ERROR] {msg.error()}")
-                        continue
-                
-                # Extract VIN from message key (used for partitioning)
-                vehicle_vin = msg.key().decode('utf-8') if msg.key() else "5YJ3E1EA1KF000001"
-                
-                # Get message value (protobuf binary data)
-                data = msg.value()
-                
-                # Process message asynchronously in the thread's event loop
-                loop.run_until_complete(process_telemetry_data(data, vehicle_vin, is_compressed=True))
-                
-                message_count += 1
-                if message_count % 100 == 0:
-                    print(f"[KAFKA] Processed {message_count} messages")
-                    
-            except KeyboardInterrupt:
-                break
+                msgs = await poll
+                # Fetch the next batch while this one is processed
+                poll = loop.run_in_executor(kafka_pool, consumer.consume, KAFKA_BATCH_SIZE, 0.5)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                print(f"[KAFKA ERROR] Error processing message: {e}")
+                log_line(f"[KAFKA ERROR] Error consuming messages: {e}")
+                poll = loop.run_in_executor(kafka_pool, consumer.consume, KAFKA_BATCH_SIZE, 0.5)
                 continue
+            
+            for msg in msgs:
+                try:
+                    if msg.error():
+                        if msg.error().code() == KafkaError._PARTITION_EOF:
+                            # End of partition event - not an error
+                            continue
+                        else:
+                            log_line(f"[KAFKA ERROR] {msg.error()}")
+                            continue
+                    
+                    # Only track partitions still assigned; a rebalance may
+                    # have revoked this one while the batch was in flight
+                    key = (msg.topic(), msg.partition())
+                    with offsets_lock:
+                        if key in assigned:
+                            pending_offsets[key] = msg.offset() + 1
+                    
+                    # Extract VIN from message key (used for partitioning)
+                    vehicle_vin = msg.key().decode('utf-8') if msg.key() else "5YJ3E1EA1KF000001"
+                    
+                    # Get message value (protobuf binary data)
+                    data = msg.value()
+                    
+                    # Skip redelivered/resent identical payloads
+                    if is_duplicate_payload(vehicle_vin, data):
+                        continue
+                    
+                    await process_telemetry_data(data, vehicle_vin, is_compressed=True)
+                    
+                    message_count += 1
+                    if message_count % 100 == 0:
+                        log_line(f"[KAFKA] Processed {message_count} messages")
+                        
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log_line(f"[KAFKA ERROR] Error processing message: {e}")
+                    continue
+            
+            # Commit this batch's offsets once it has been processed. Offsets
+            # are explicit: the consumer's position already includes the
+            # next batch being fetched in the background.
+            batch_offsets = take_offsets()
+            if batch_offsets:
+                try:
+                    consumer.commit(offsets=offset_list(batch_offsets), asynchronous=True)
+                except KafkaException as e:
+                    log_line(f"[KAFKA ERROR] Commit failed: {e}")
                 
+    except asyncio.CancelledError:
+        pass
     except Exception as e:
         print(f"[KAFKA ERROR] Consumer error: {e}")
     finally:
         if consumer:
-            consumer.close()
-        loop.close()
+            # Let an outstanding poll finish before closing on the same thread
+            if poll is not None:
+                await asyncio.gather(poll, return_exceptions=True)
+            final_offsets = take_offsets()
+            if final_offsets:
+                try:
+                    await loop.run_in_executor(
+                        kafka_pool,
+                        lambda: consumer.commit(offsets=offset_list(final_offsets), asynchronous=False)
+                    )
+                except KafkaException as e:
+                    print(f"[KAFKA ERROR] Final commit failed: {e}")
+            await loop.run_in_executor(kafka_pool, consumer.close)
         kafka_consumer_running = False
         print("[KAFKA] Consumer stopped")
 
@@ -361,23 +891,12 @@ async def websocket_endpoint(websocket: WebSocket):
     
     try:
         # Send initial log messages
-        await websocket.send_json({
-            "type": "log",
-            "message": "Connected to telemetry server",
-            "log_type": "success"
-        })
+        await websocket.send_bytes(CONNECTED_FRAME)
         
         # Send historical data on connect
-        await websocket.send_json({
-            "type": "history",
-            "data": telemetry_buffer[-100:] if len(telemetry_buffer) > 100 else telemetry_buffer
-        })
-        
-        await websocket.send_json({
-            "type": "log",
-            "message": f"Loaded {min(len(telemetry_buffer), 100)} historical telemetry records",
-            "log_type": "info"
-        })
+        history, loaded_log = get_history_frames()
+        await websocket.send_bytes(history)
+        await websocket.send_bytes(loaded_log)
         
         # Keep connection alive
         while True:
@@ -410,7 +929,7 @@ async def status():
     return {
         "total_records": len(telemetry_buffer),
         "active_websockets": len(manager.active_connections),
-        "latest": telemetry_buffer[-10:] if telemetry_buffer else [],
+        "latest": recent_telemetry(10),
         "script_running": script_process is not None and script_process.returncode is None,
         "compression_stats": g_predictor.get_compression_stats()
     }
@@ -427,6 +946,7 @@ async def start_script():
     try:
         # Reset predictor when starting new script
         g_predictor.reset()
+        _stats_cache[1] = None
         
         # Path to the logger executable
         logger_path = os.path.join(os.path.dirname(__file__), "..", "cpp_edge", "logger")
@@ -511,14 +1031,17 @@ async def toggle_offline():
 @app.post("/clear_data")
 async def clear_data():
     """Clear all telemetry data"""
-    global telemetry_buffer, g_predictor
+    global telemetry_buffer, g_predictor, history_frame
     
     try:
         telemetry_buffer.clear()
+        history_frame = None
+        last_payload_hash.clear()
         # Reset predictor statistics
         g_predictor.total_readings = 0
         g_predictor.transmitted_readings = 0
         g_predictor.skipped_readings = 0
+        _stats_cache[1] = None
         await manager.broadcast_log("=== Data Cleared ===", "info")
         return {"status": "success", "message": "Data cleared", "records_cleared": 0}
     except Exception as e:
@@ -526,6 +1049,55 @@ async def clear_data():
         return {"status": "error", "message": str(e)}
 
 
+@app.on_event("startup")
+async def startup():
+    """Start the broadcast flusher, Kafka consumer and Supabase upload worker"""
+    global upload_loop, upload_queue, upload_worker_task, upload_timer_task, kafka_consumer_task
+    
+    manager.start()
+    
+    if KAFKA_ENABLED:
+        kafka_consumer_task = asyncio.create_task(kafka_consumer_loop())
+    
+    if USE_SUPABASE:
+        await supabase.start_async()
+        upload_loop = asyncio.get_running_loop()
+        upload_queue = asyncio.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        upload_worker_task = asyncio.create_task(supabase_upload_worker())
+        upload_timer_task = asyncio.create_task(supabase_flush_timer())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Flush buffered telemetry to Supabase before exiting"""
+    global kafka_consumer_running
+    
+    if kafka_consumer_task:
+        kafka_consumer_running = False
+        await kafka_consumer_task
+    kafka_pool.shutdown(wait=False)
+    parse_pool.shutdown(wait=False)
+    await manager.stop()
+    
+    if not USE_SUPABASE:
+        return
+    
+    # Stop the timer; the final flush below writes whatever it left buffered
+    if upload_timer_task:
+        upload_timer_task.cancel()
+    
+    # Let the worker write everything already queued (including a batch it
+    # is partway through) instead of cancelling it mid-batch
+    if upload_worker_task:
+        await upload_queue.put(None)
+        await upload_worker_task
+    
+    # Then anything still buffered
+    await supabase.flush_async()
+    await supabase.aclose()
+    supabase.close()
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8001))
     print("\n=== Tesla Telemetry Server ===")
@@ -534,14 +1106,25 @@ if __name__ == "__main__":
     print(f"Status: http://0.0.0.0:{port}/status")
     print(f"Dashboard: http://0.0.0.0:{port}/")
     
-    # Start Kafka consumer in background thread if enabled
+    # Kafka consumer starts with the app (see startup)
     if KAFKA_ENABLED:
-        print(f"\n[KAFKA] Starting Kafka consumer...")
-        kafka_consumer_thread = threading.Thread(target=kafka_consumer_loop, daemon=True)
-        kafka_consumer_thread.start()
-        print(f"[KAFKA] Consumer thread started")
+        print(f"\n[KAFKA] Kafka consumer enabled")
     else:
         print(f"\n[KAFKA] Kafka consumer disabled (using HTTP endpoint)")
     
     print()
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # uvloop event loop and httptools parser (both in uvicorn[standard]);
+    # fall back to the stdlib loop where uvloop isn't available (Windows).
+    # Single worker: the buffer, predictor and WebSocket clients are
+    # in-process state. Per-request access logging is off on the hot path.
+    # permessage-deflate is off: large frames are compressed once in
+    # encode_frame rather than per connection.
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop" if UVLOOP_AVAILABLE else "asyncio",
+        http="httptools" if HTTPTOOLS_AVAILABLE else "h11",
+        access_log=False,
+        ws_per_message_deflate=False,
+    )
@@ -0,0 +1,79 @@
+"""
+Telemetry Ring - columnar in-memory buffer for recent telemetry
+Stores each field in a preallocated NumPy array instead of one dict per record
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# Column name -> dtype, in telemetry_dict key order
+COLUMNS = {
+    "timestamp": np.int64,
+    "speed": np.float64,
+    "battery": np.float64,
+    "power": np.float64,
+    "odometer": np.float64,
+    "heading": np.int32,
+}
+
+
+class TelemetryRing:
+    """
+    Fixed-capacity ring buffer with one contiguous array per field.
+    received_at is kept as integer microseconds and formatted on read.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.cols = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.received_us = np.zeros(capacity, dtype=np.int64)
+        self.head = 0  # next write position
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, record: Dict, received_us: Optional[int] = None) -> None:
+        """
+        Write one telemetry_dict, overwriting the oldest record when full.
+        Pass received_us (epoch microseconds) to skip parsing received_at.
+        """
+        i = self.head
+        for name, col in self.cols.items():
+            col[i] = record[name]
+        if received_us is None:
+            received = datetime.fromisoformat(record["received_at"])
+            received_us = int(received.timestamp()) * 1_000_000 + received.microsecond
+        self.received_us[i] = received_us
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def clear(self) -> None:
+        self.head = 0
+        self.size = 0
+
+    def _indices(self, n: int) -> np.ndarray:
+        """Ring positions of the last n records, oldest first"""
+        n = min(n, self.size)
+        return np.arange(self.head - n, self.head) % self.capacity
+
+    def recent(self, n: int) -> List[Dict]:
+        """Return the last n records as telemetry dicts, oldest first"""
+        idx = self._indices(n)
+        columns = {name: col[idx].tolist() for name, col in self.cols.items()}
+        # Format each distinct second once; records mostly share seconds
+        prefixes = {}
+        received_at = []
+        for us in self.received_us[idx].tolist():
+            sec, micros = divmod(us, 1_000_000)
+            prefix = prefixes.get(sec)
+            if prefix is None:
+                prefix = prefixes[sec] = datetime.fromtimestamp(sec).isoformat()
+            received_at.append(f"{prefix}.{micros:06d}")
+        return [
+            {**dict(zip(columns, row)), "received_at": ts}
+            for row, ts in zip(zip(*columns.values()), received_at)
+        ]